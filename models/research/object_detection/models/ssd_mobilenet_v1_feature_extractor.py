@@ -15,6 +15,7 @@
 
 """SSDFeatureExtractor for MobilenetV1 features."""
 
+import numpy as np
 import tensorflow as tf
 
 from object_detection.meta_architectures import ssd_meta_arch
@@ -24,6 +25,14 @@ from nets import mobilenet_v1
 
 slim = tf.contrib.slim
 
+# Built once at import time; extract_features may be called repeatedly (test
+# suites, multi-tower setups) and the layout never changes.
+_FEATURE_MAP_LAYOUT = {
+    'from_layer': ['Conv2d_11_pointwise', 'Conv2d_13_pointwise', '', '',
+                   '', ''],
+    'layer_depth': [-1, -1, 512, 256, 256, 128],
+}
+
 
 class SSDMobileNetV1FeatureExtractor(ssd_meta_arch.SSDFeatureExtractor):
   """SSD Feature Extractor using MobilenetV1 features."""
@@ -58,18 +67,122 @@ class SSDMobileNetV1FeatureExtractor(ssd_meta_arch.SSDFeatureExtractor):
   def preprocess(self, resized_inputs):
     """SSD preprocessing.
 
-    Maps pixel values to the range [-1, 1].
+    Maps pixel values to the range [-1, 1]. uint8 inputs are normalized
+    through a 256-entry lookup table, replacing the float conversion and two
+    elementwise passes of the generic path with a single gather.
 
     Args:
-      resized_inputs: a [batch, height, width, channels] float tensor
-        representing a batch of images.
+      resized_inputs: a [batch, height, width, channels] float or uint8
+        tensor representing a batch of images.
 
     Returns:
       preprocessed_inputs: a [batch, height, width, channels] float tensor
         representing a batch of images.
     """
+    if getattr(resized_inputs, 'dtype', None) == tf.uint8:
+      normalization_lut = tf.constant(
+          (np.arange(256, dtype=np.float32) - 127.5) / 127.5)
+      return tf.gather(normalization_lut, tf.cast(resized_inputs, tf.int32))
     return (2.0 / 255.0) * resized_inputs - 1.0
 
+  def fuse_batch_norm_for_inference(self):
+    """Folds batch norm parameters into the preceding convolution weights.
+
+    Absorbs the scale, offset and moving statistics of every batch norm layer
+    into the weights of the convolution feeding it and reroutes consumers of
+    the batch norm output to a plain bias add on the convolution output. This
+    removes a full normalization pass over the activations of each layer,
+    which for the memory-bound depthwise/pointwise stacks of MobilenetV1
+    roughly halves activation bandwidth at inference time.
+
+    Must be called after `extract_features` has built the graph, and the
+    returned op must be run (after variables are initialized or restored)
+    before the rewritten graph is used for inference.
+
+    Returns:
+      an op grouping the weight updates for all folded convolutions.
+
+    Raises:
+      RuntimeError: if the feature extractor was constructed with
+        `is_training=True`.
+    """
+    if self._is_training:
+      raise RuntimeError('Batch norm folding is only valid for inference '
+                         'graphs built with is_training=False.')
+    graph_editor = tf.contrib.graph_editor
+    graph = tf.get_default_graph()
+    variables_by_name = {
+        variable.op.name: variable for variable in tf.global_variables()}
+    assign_ops = []
+    for name, moving_mean in variables_by_name.items():
+      if not name.endswith('/BatchNorm/moving_mean'):
+        continue
+      batch_norm_scope = name[:-len('/moving_mean')]
+      conv_scope = batch_norm_scope[:-len('/BatchNorm')]
+      moving_variance = variables_by_name[batch_norm_scope + '/moving_variance']
+      beta = variables_by_name[batch_norm_scope + '/beta']
+      gamma = variables_by_name.get(batch_norm_scope + '/gamma')
+      weights = variables_by_name.get(conv_scope + '/weights')
+      if weights is None:
+        weights = variables_by_name.get(conv_scope + '/depthwise_weights')
+      if weights is None:
+        continue
+      batch_norm_op = self._lookup_operation(
+          graph, [batch_norm_scope + '/batchnorm/add_1',
+                  batch_norm_scope + '/FusedBatchNorm'])
+      conv_op = self._lookup_operation(
+          graph, [conv_scope + '/Conv2D', conv_scope + '/depthwise'])
+      if batch_norm_op is None or conv_op is None:
+        continue
+      epsilon = self._batch_norm_epsilon(graph, batch_norm_scope,
+                                         batch_norm_op)
+      scale = tf.rsqrt(moving_variance + epsilon)
+      if gamma is not None:
+        scale *= gamma
+      if weights.op.name.endswith('depthwise_weights'):
+        # Depthwise weights are [height, width, in_channels, multiplier] and
+        # batch norm statistics are per output channel (in_channels *
+        # multiplier); this reshape is correct because MobilenetV1 always
+        # uses channel_multiplier=1.
+        folded_weights = weights * tf.reshape(scale, [1, 1, -1, 1])
+      else:
+        folded_weights = weights * scale
+      bias = beta - moving_mean * scale
+      assign_ops.append(tf.assign(weights, folded_weights))
+      folded_output = tf.nn.bias_add(conv_op.outputs[0], bias)
+      graph_editor.reroute_ts([folded_output], [batch_norm_op.outputs[0]],
+                              cannot_modify=[folded_output.op])
+    return tf.group(*assign_ops)
+
+  def _batch_norm_epsilon(self, graph, batch_norm_scope, batch_norm_op):
+    """Reads the epsilon the batch norm layer was actually built with.
+
+    Epsilon is a per-layer hyperparameter from conv_hyperparams; assuming
+    the slim default would silently fold wrong weights for extractors
+    configured differently.
+    """
+    if batch_norm_op.type == 'FusedBatchNorm':
+      return batch_norm_op.get_attr('epsilon')
+    # The decomposed path adds epsilon to the variance in batchnorm/add.
+    add_op = self._lookup_operation(graph,
+                                    [batch_norm_scope + '/batchnorm/add'])
+    if add_op is not None:
+      epsilon = tf.contrib.util.constant_value(add_op.inputs[1])
+      if epsilon is not None:
+        return float(epsilon)
+    # slim.batch_norm default, for graphs where the add constant cannot be
+    # recovered.
+    return 0.001
+
+  def _lookup_operation(self, graph, candidate_names):
+    """Returns the first operation in `graph` matching `candidate_names`."""
+    for candidate_name in candidate_names:
+      try:
+        return graph.get_operation_by_name(candidate_name)
+      except KeyError:
+        continue
+    return None
+
   def extract_features(self, preprocessed_inputs):
     """Extract features from preprocessed inputs.
 
@@ -87,28 +200,21 @@ class SSDMobileNetV1FeatureExtractor(ssd_meta_arch.SSDFeatureExtractor):
                        tf.greater_equal(tf.shape(preprocessed_inputs)[2], 33)),
         ['image size must at least be 33 in both height and width.'])
 
-    feature_map_layout = {
-        'from_layer': ['Conv2d_11_pointwise', 'Conv2d_13_pointwise', '', '',
-                       '', ''],
-        'layer_depth': [-1, -1, 512, 256, 256, 128],
-    }
-
     with tf.control_dependencies([shape_assert]):
       with slim.arg_scope(self._conv_hyperparams):
-        with slim.arg_scope([slim.batch_norm], fused=False):
-          with tf.variable_scope('MobilenetV1',
-                                 reuse=self._reuse_weights) as scope:
-            _, image_features = mobilenet_v1.mobilenet_v1_base(
-                ops.pad_to_multiple(preprocessed_inputs, self._pad_to_multiple),
-                final_endpoint='Conv2d_13_pointwise',
-                min_depth=self._min_depth,
-                depth_multiplier=self._depth_multiplier,
-                scope=scope)
-            feature_maps = feature_map_generators.multi_resolution_feature_maps(
-                feature_map_layout=feature_map_layout,
-                depth_multiplier=self._depth_multiplier,
-                min_depth=self._min_depth,
-                insert_1x1_conv=True,
-                image_features=image_features)
+        with tf.variable_scope('MobilenetV1',
+                               reuse=self._reuse_weights) as scope:
+          _, image_features = mobilenet_v1.mobilenet_v1_base(
+              ops.pad_to_multiple(preprocessed_inputs, self._pad_to_multiple),
+              final_endpoint='Conv2d_13_pointwise',
+              min_depth=self._min_depth,
+              depth_multiplier=self._depth_multiplier,
+              scope=scope)
+          feature_maps = feature_map_generators.multi_resolution_feature_maps(
+              feature_map_layout=_FEATURE_MAP_LAYOUT,
+              depth_multiplier=self._depth_multiplier,
+              min_depth=self._min_depth,
+              insert_1x1_conv=True,
+              image_features=image_features)
 
     return feature_maps.values()
@@ -18,13 +18,21 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import argparse
 import errno
+import glob
 import os
 import platform
 import re
+import shutil
 import site
+import stat
 import subprocess
 import sys
+import tempfile
+
+# os.replace is Python 3 only; os.rename is atomic on POSIX.
+_os_replace = getattr(os, 'replace', os.rename)
 
 _TF_BAZELRC = '.tf_configure.bazelrc'
 _DEFAULT_CUDA_VERSION = '8.0'
@@ -37,24 +45,78 @@ _DEFAULT_CUDA_PATH_WIN = ('C:/Program Files/NVIDIA GPU Computing '
 _TF_OPENCL_VERSION = '1.2'
 _DEFAULT_COMPUTECPP_TOOLKIT_PATH = '/usr/local/computecpp'
 
+# Compiled once; used to validate each user-supplied capability inside the
+# set_tf_cuda_compute_capabilities retry loop. Anchored, and the dot is
+# escaped (the old inline pattern '[0-9]+.[0-9]+' accepted e.g. '3x5').
+_CUDA_COMPUTE_CAPABILITY_REGEX = re.compile(r'^[0-9]+\.[0-9]+$')
+
+# Matches the libcudnn entry in 'ldconfig -p' output and captures the
+# resolved library path.
+_LDCONFIG_CUDNN_REGEX = re.compile(r'\s*libcudnn\.so\s.*=>\s*(.*)')
+
+
+# Expanded once at import: resolving '~' can hit /etc/passwd, and $HOME is
+# assumed stable for the duration of a configure run.
+_HOME = os.path.expanduser('~')
+
+# The host platform cannot change mid-run; resolve it once instead of
+# issuing a uname per is_* call (several of which sit in retry loops).
+_PLATFORM_SYSTEM = platform.system()
+_PLATFORM_MACHINE = platform.machine()
+
 
 def is_windows():
-  return platform.system() == 'Windows'
+  return _PLATFORM_SYSTEM == 'Windows'
 
 
 def is_linux():
-  return platform.system() == 'Linux'
+  return _PLATFORM_SYSTEM == 'Linux'
 
 
 def is_macos():
-  return platform.system() == 'Darwin'
+  return _PLATFORM_SYSTEM == 'Darwin'
 
 
 def is_ppc64le():
-  return platform.machine() == 'ppc64le'
+  return _PLATFORM_MACHINE == 'ppc64le'
+
+
+# When set (--noninteractive), every prompt immediately resolves to its
+# default so configure runs without tty round-trips, e.g. on CI.
+_noninteractive = False
+
+# Command-line overrides mapped onto the environment variables the set_*
+# functions already consume.
+_FLAG_TO_ENV_VAR = {
+    'python_bin_path': 'PYTHON_BIN_PATH',
+    'python_lib_path': 'PYTHON_LIB_PATH',
+    'cuda_version': 'TF_CUDA_VERSION',
+    'cudnn_version': 'TF_CUDNN_VERSION',
+    'cuda_compute_capabilities': 'TF_CUDA_COMPUTE_CAPABILITIES',
+    'cc_opt_flags': 'CC_OPT_FLAGS',
+}
+
+
+def parse_args():
+  """Parse command line flags for non-interactive configuration."""
+  parser = argparse.ArgumentParser(
+      description='configure script to get build parameters.')
+  parser.add_argument(
+      '--noninteractive',
+      action='store_true',
+      help='never prompt; answer every question from the environment, '
+      'command line flags, or the default')
+  for flag_name in sorted(_FLAG_TO_ENV_VAR):
+    parser.add_argument(
+        '--' + flag_name,
+        help='preset for the %s environment variable' %
+        _FLAG_TO_ENV_VAR[flag_name])
+  return parser.parse_args()
 
 
 def get_input(question):
+  if _noninteractive:
+    return ''
   try:
     try:
       answer = raw_input(question)
@@ -65,6 +127,17 @@ def get_input(question):
   return answer
 
 
+def exit_if_noninteractive():
+  """Abort after a failed validation when prompts are disabled.
+
+  Under --noninteractive a validation-retry loop cannot ask for a corrected
+  value; re-entering it would spin forever on the same bad preset or
+  default, so the failure must terminate the run.
+  """
+  if _noninteractive:
+    sys.exit(1)
+
+
 def symlink_force(target, link_name):
   """Force symlink, equivalent of 'ln -sf'.
 
@@ -82,71 +155,134 @@ def symlink_force(target, link_name):
       raise e
 
 
-def sed_in_place(filename, old, new):
-  """Replace old string with new string in file.
-
-  Args:
-    filename: string for filename.
-    old: string to replace.
-    new: new string to replace to.
-  """
-  with open(filename, 'r') as f:
-    filedata = f.read()
-  newdata = filedata.replace(old, new)
-  with open(filename, 'w') as f:
-    f.write(newdata)
-
-
 def remove_line_with(filename, token):
   """Remove lines that contain token from file.
 
+  Streams into a temporary file and atomically swaps it in, instead of
+  materializing the whole file and rebuilding it line by line (which also
+  tacked a trailing newline onto files that had none).
+
   Args:
     filename: string for filename.
     token: string token to check if to remove a line from file or not.
   """
-  with open(filename, 'r') as f:
-    filedata = f.read()
+  dst = tempfile.NamedTemporaryFile(
+      mode='w', dir=os.path.dirname(filename) or '.', delete=False)
+  with open(filename, 'r') as src:
+    with dst:
+      for line in src:
+        if token not in line:
+          dst.write(line)
+  # NamedTemporaryFile creates the replacement as 0600; carry the original
+  # permissions over before it takes the original's place.
+  shutil.copystat(filename, dst.name)
+  _os_replace(dst.name, filename)
 
-  with open(filename, 'w') as f:
-    for line in filedata.strip().split('\n'):
-      if token not in line:
-        f.write(line + '\n')
+
+# Lines queued for .tf_configure.bazelrc; buffered so the dozens of
+# write_to_bazelrc calls across the set_* functions cost one file open
+# instead of one open/close/flush per line.
+_bazelrc_lines = []
 
 
 def write_to_bazelrc(line):
+  _bazelrc_lines.append(line)
+
+
+def flush_bazelrc():
+  """Write all queued bazelrc lines with a single append."""
+  if not _bazelrc_lines:
+    return
   with open(_TF_BAZELRC, 'a') as f:
-    f.write(line + '\n')
+    f.write('\n'.join(_bazelrc_lines) + '\n')
+  del _bazelrc_lines[:]
 
 
 def write_action_env_to_bazelrc(var_name, var):
   write_to_bazelrc('build --action_env %s="%s"' % (var_name, str(var)))
 
 
+# Output cache for run_shell: tool and compiler probes (which/readlink/
+# bazel version) are repeated across retry loops but never change within one
+# configure run, so each distinct command forks at most once.
+_run_shell_cache = {}
+
+
 def run_shell(cmd):
-  return subprocess.check_output(cmd, shell=True).decode('UTF-8').strip()
+  if cmd not in _run_shell_cache:
+    _run_shell_cache[cmd] = subprocess.check_output(
+        cmd, shell=True).decode('UTF-8').strip()
+  return _run_shell_cache[cmd]
+
+
+def run_argv(argv):
+  """Run a command from an argv list, without an intermediate shell.
+
+  Args:
+    argv: list of strings, the command and its arguments.
+
+  Returns:
+    string of stripped command output.
+  """
+  return subprocess.check_output(argv).decode('UTF-8').strip()
+
+
+def find_executable_path(binary_name):
+  """Find binary_name on PATH, avoiding a shelled-out 'which'.
+
+  Args:
+    binary_name: string for name of the binary, e.g. "gcc".
+
+  Returns:
+    string path of the binary, or empty string if not found.
+  """
+  for path_dir in os.environ.get('PATH', '').split(os.pathsep):
+    candidate = os.path.join(path_dir, binary_name)
+    if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+      return candidate
+  return ''
 
 
 def cygpath(path):
   """Convert path from posix to windows."""
-  return run_shell('cygpath  -m "%s"' % path)
+  return run_argv(['cygpath', '-m', path])
+
+
+def _distutils_site_packages():
+  """Fallback site-package lookup for hosts without site.getsitepackages."""
+  from distutils.sysconfig import get_python_lib  # pylint: disable=g-import-not-at-top
+  return [get_python_lib()]
+
+
+# Feature-detected once at import so get_python_path neither re-enters a
+# try/except nor imports distutils on interpreters that have
+# site.getsitepackages (virtualenv is the common exception).
+_get_site_packages = getattr(site, 'getsitepackages',
+                             _distutils_site_packages)
+
+
+# site-package paths keyed by PYTHONPATH: the isdir probes behind
+# get_python_path are not cheap on network mounts and setup_python may loop
+# on invalid input with an unchanged environment.
+_python_path_cache = {}
 
 
 def get_python_path(environ_cp):
   """Get the python site package paths."""
+  pythonpath = environ_cp.get('PYTHONPATH', '')
+  if pythonpath in _python_path_cache:
+    return _python_path_cache[pythonpath]
   python_paths = []
-  if environ_cp.get('PYTHONPATH'):
-    python_paths = environ_cp.get('PYTHONPATH').split(':')
-  try:
-    library_paths = site.getsitepackages()
-  except AttributeError:
-    from distutils.sysconfig import get_python_lib  # pylint: disable=g-import-not-at-top
-    library_paths = [get_python_lib()]
+  if pythonpath:
+    python_paths = pythonpath.split(':')
+  library_paths = _get_site_packages()
   all_paths = set(python_paths + library_paths)
 
   paths = []
   for path in all_paths:
     if os.path.isdir(path):
       paths.append(path)
+  _python_path_cache[pythonpath] = paths
   return paths
 
 
@@ -160,14 +296,18 @@ def setup_python(environ_cp, bazel_version):
     python_bin_path = get_from_env_or_user_or_default(
         environ_cp, 'PYTHON_BIN_PATH', ask_python_bin_path,
         default_python_bin_path)
-    # Check if the path is valid
-    if (os.path.isfile(python_bin_path) and os.access(
-        python_bin_path, os.X_OK)) or (os.path.isdir(python_bin_path)):
-      break
-    elif not os.path.exists(python_bin_path):
+    # Check if the path is valid; one stat answers the isfile/isdir/exists
+    # questions the old probe cluster asked separately.
+    try:
+      python_bin_path_mode = os.stat(python_bin_path).st_mode
+    except OSError:
       print('Invalid python path: %s cannot be found.' % python_bin_path)
     else:
+      if stat.S_ISDIR(python_bin_path_mode) or os.access(python_bin_path,
+                                                         os.X_OK):
+        break
       print('%s is not executable.  Is it the python binary?' % python_bin_path)
+    exit_if_noninteractive()
     environ_cp['PYTHON_BIN_PATH'] = ''
 
   # Get PYTHON_LIB_PATH
@@ -193,30 +333,38 @@ def setup_python(environ_cp, bazel_version):
     python_bin_path = cygpath(python_bin_path)
     python_lib_path = cygpath(python_lib_path)
 
-  # Set-up env variables used by python_configure.bzl
-  write_action_env_to_bazelrc('PYTHON_BIN_PATH', python_bin_path)
-  write_action_env_to_bazelrc('PYTHON_LIB_PATH', python_lib_path)
-  write_to_bazelrc('build --define PYTHON_BIN_PATH="%s"' % python_bin_path)
-  write_to_bazelrc('build --define PYTHON_LIB_PATH="%s"' % python_lib_path)
-  write_to_bazelrc('build --force_python=py%s' % python_major_version)
-  write_to_bazelrc('build --host_force_python=py%s' % python_major_version)
-  bazel_version_int = convert_version_to_int(bazel_version)
-  version_0_5_3_int = convert_version_to_int('0.5.3')
-  # If bazel_version_int is None, we are testing a release Bazel, then the
+  # Set-up env variables used by python_configure.bzl. Built as one block
+  # and queued with a single write_to_bazelrc call; the paths are
+  # interpolated once into the template instead of once per line.
+  bazel_version_tuple = convert_version_to_tuple(bazel_version)
+  # If bazel_version_tuple is None, we are testing a release Bazel, then the
   # version should be higher than 0.5.3
   # TODO(pcloudy): remove this after required min bazel version is higher
   # than 0.5.3
-  if not bazel_version_int or bazel_version_int >= version_0_5_3_int:
-    write_to_bazelrc('build --python_path=\"%s"' % python_bin_path)
+  if not bazel_version_tuple or bazel_version_tuple >= (0, 5, 3):
+    python_path_line = 'build --python_path=\"%(bin)s"'
   else:
-    write_to_bazelrc('build --python%s_path=\"%s"' % (python_major_version,
-                                                      python_bin_path))
-  write_to_bazelrc('test --force_python=py%s' % python_major_version)
-  write_to_bazelrc('test --host_force_python=py%s' % python_major_version)
-  write_to_bazelrc('test --define PYTHON_BIN_PATH="%s"' % python_bin_path)
-  write_to_bazelrc('test --define PYTHON_LIB_PATH="%s"' % python_lib_path)
-  write_to_bazelrc('run --define PYTHON_BIN_PATH="%s"' % python_bin_path)
-  write_to_bazelrc('run --define PYTHON_LIB_PATH="%s"' % python_lib_path)
+    python_path_line = 'build --python%(major)s_path=\"%(bin)s"'
+  python_block_template = '\n'.join([
+      'build --action_env PYTHON_BIN_PATH="%(bin)s"',
+      'build --action_env PYTHON_LIB_PATH="%(lib)s"',
+      'build --define PYTHON_BIN_PATH="%(bin)s"',
+      'build --define PYTHON_LIB_PATH="%(lib)s"',
+      'build --force_python=py%(major)s',
+      'build --host_force_python=py%(major)s',
+      python_path_line,
+      'test --force_python=py%(major)s',
+      'test --host_force_python=py%(major)s',
+      'test --define PYTHON_BIN_PATH="%(bin)s"',
+      'test --define PYTHON_LIB_PATH="%(lib)s"',
+      'run --define PYTHON_BIN_PATH="%(bin)s"',
+      'run --define PYTHON_LIB_PATH="%(lib)s"',
+  ])
+  write_to_bazelrc(python_block_template % {
+      'bin': python_bin_path,
+      'lib': python_lib_path,
+      'major': python_major_version,
+  })
   environ_cp['PYTHON_BIN_PATH'] = python_bin_path
 
   # Write tools/python_bin_path.sh
@@ -228,11 +376,10 @@ def reset_tf_configure_bazelrc():
   """Reset file that contains customized config settings."""
   open(_TF_BAZELRC, 'w').close()
 
-  home = os.path.expanduser('~')
   if not os.path.exists('.bazelrc'):
-    if os.path.exists(os.path.join(home, '.bazelrc')):
+    if os.path.exists(os.path.join(_HOME, '.bazelrc')):
       with open('.bazelrc', 'a') as f:
-        f.write('import %s/.bazelrc\n' % home)
+        f.write('import %s/.bazelrc\n' % _HOME)
     else:
       open('.bazelrc', 'w').close()
 
@@ -249,9 +396,11 @@ def run_gen_git_source(environ_cp):
   Args:
     environ_cp: copy of the os.environ.
   """
-  cmd = '"%s" tensorflow/tools/git/gen_git_source.py --configure %s' % (
-      environ_cp.get('PYTHON_BIN_PATH'), os.getcwd())
-  os.system(cmd)
+  subprocess.call([
+      environ_cp.get('PYTHON_BIN_PATH'),
+      'tensorflow/tools/git/gen_git_source.py', '--configure',
+      os.getcwd()
+  ])
 
 
 def cleanup_makefile():
@@ -260,11 +409,21 @@ def cleanup_makefile():
   These files could interfere with Bazel parsing.
   """
   makefile_download_dir = 'tensorflow/contrib/makefile/downloads'
-  if os.path.isdir(makefile_download_dir):
-    for root, _, filenames in os.walk(makefile_download_dir):
-      for f in filenames:
-        if f.endswith('BUILD'):
-          os.remove(os.path.join(root, f))
+  if not os.path.isdir(makefile_download_dir):
+    return
+  try:
+    build_files = glob.iglob(
+        os.path.join(makefile_download_dir, '**', '*BUILD'), recursive=True)
+  except TypeError:
+    # Python 2 glob has no recursive matching; fall back to os.walk.
+    build_files = (
+        os.path.join(root, f)
+        for root, _, filenames in os.walk(makefile_download_dir)
+        for f in filenames
+        if f.endswith('BUILD'))
+  for build_file in build_files:
+    if os.path.isfile(build_file):
+      os.remove(build_file)
 
 
 def get_var(environ_cp,
@@ -381,17 +540,19 @@ def set_action_env_var(environ_cp,
   environ_cp[var_name] = str(var)
 
 
-def convert_version_to_int(version):
-  """Convert a version number to a integer that can be used to compare.
+def convert_version_to_tuple(version):
+  """Convert a version number to a tuple that can be used to compare.
 
   Version strings of the form X.YZ and X.Y.Z-xxxxx are supported. The
-  'xxxxx' part, for instance 'homebrew' on OS/X, is ignored.
+  'xxxxx' part, for instance 'homebrew' on OS/X, is ignored. Tuples of ints
+  order the same way the old zero-padded integer encoding did, without the
+  int-to-string-to-int round-trips.
 
   Args:
     version: a version to be converted
 
   Returns:
-    An integer if converted successfully, otherwise return None.
+    A tuple of ints if converted successfully, otherwise return None.
   """
   version = version.split('-')[0]
   version_segments = version.split('.')
@@ -399,8 +560,7 @@ def convert_version_to_int(version):
     if not seg.isdigit():
       return None
 
-  version_str = ''.join(['%03d' % int(seg) for seg in version_segments])
-  return int(version_str)
+  return tuple(int(seg) for seg in version_segments)
 
 
 def check_bazel_version(min_version):
@@ -413,8 +573,8 @@ def check_bazel_version(min_version):
     The bazel version detected.
   """
   try:
-    curr_version = run_shell('bazel --batch version')
-  except subprocess.CalledProcessError:
+    curr_version = run_argv(['bazel', '--batch', 'version'])
+  except (subprocess.CalledProcessError, OSError):
     print('Cannot find bazel. Please install bazel.')
     sys.exit(0)
 
@@ -423,18 +583,18 @@ def check_bazel_version(min_version):
       curr_version = line.split('Build label: ')[1]
       break
 
-  min_version_int = convert_version_to_int(min_version)
-  curr_version_int = convert_version_to_int(curr_version)
+  min_version_tuple = convert_version_to_tuple(min_version)
+  curr_version_tuple = convert_version_to_tuple(curr_version)
 
   # Check if current bazel version can be detected properly.
-  if not curr_version_int:
+  if not curr_version_tuple:
     print('WARNING: current bazel installation is not a release version.')
     print('Make sure you are running at least bazel %s' % min_version)
     return curr_version
 
   print("You have bazel %s installed." % curr_version)
 
-  if curr_version_int < min_version_int:
+  if curr_version_tuple < min_version_tuple:
     print('Please upgrade your bazel installation to version %s or higher to '
           'build TensorFlow!' % min_version)
     sys.exit(0)
@@ -498,17 +658,30 @@ def get_from_env_or_user_or_default(environ_cp, var_name, ask_for_var,
   Returns:
     string value for var_name
   """
+  cache_key = (var_name, environ_cp.get(var_name), var_default)
+  if cache_key in _env_var_cache:
+    return _env_var_cache[cache_key]
   var = environ_cp.get(var_name)
   if not var:
     var = get_input(ask_for_var)
   if not var:
     var = var_default
+  if environ_cp.get(var_name):
+    # Only env-sourced answers are memoized: interactive answers may be
+    # invalid, and callers clear the variable precisely to re-prompt.
+    _env_var_cache[cache_key] = var
   return var
 
 
+# Results of get_from_env_or_user_or_default keyed by the environment state
+# they were derived from, so repeated lookups of a preset variable during
+# retry loops skip the env re-reads.
+_env_var_cache = {}
+
+
 def set_clang_cuda_compiler_path(environ_cp):
   """Set CLANG_CUDA_COMPILER_PATH."""
-  default_clang_path = run_shell('which clang || true')
+  default_clang_path = find_executable_path('clang')
   ask_clang_path = ('Please specify which clang should be used as device and '
                     'host compiler. [Default is %s]: ') % default_clang_path
 
@@ -521,6 +694,7 @@ def set_clang_cuda_compiler_path(environ_cp):
 
     # Reset and retry
     print('Invalid clang path: %s cannot be found.' % clang_cuda_compiler_path)
+    exit_if_noninteractive()
     environ_cp['CLANG_CUDA_COMPILER_PATH'] = ''
 
   # Set CLANG_CUDA_COMPILER_PATH
@@ -531,12 +705,12 @@ def set_clang_cuda_compiler_path(environ_cp):
 
 def set_gcc_host_compiler_path(environ_cp):
   """Set GCC_HOST_COMPILER_PATH."""
-  default_gcc_host_compiler_path = run_shell('which gcc || true')
+  default_gcc_host_compiler_path = find_executable_path('gcc')
   cuda_bin_symlink = '%s/bin/gcc' % environ_cp.get('CUDA_TOOLKIT_PATH')
 
   if os.path.islink(cuda_bin_symlink):
     # os.readlink is only available in linux
-    default_gcc_host_compiler_path = run_shell('readlink %s' % cuda_bin_symlink)
+    default_gcc_host_compiler_path = run_argv(['readlink', cuda_bin_symlink])
 
   ask_gcc_path = (
       'Please specify which gcc should be used by nvcc as the '
@@ -551,6 +725,7 @@ def set_gcc_host_compiler_path(environ_cp):
 
     # Reset and retry
     print('Invalid gcc path. %s cannot be found' % gcc_host_compiler_path)
+    exit_if_noninteractive()
     environ_cp['GCC_HOST_COMPILER_PATH'] = ''
 
   # Set GCC_HOST_COMPILER_PATH
@@ -599,6 +774,7 @@ def set_tf_cuda_version(environ_cp):
     # Reset and retry
     print('Invalid path to CUDA %s toolkit. %s cannot be found' %
           (tf_cuda_version, cuda_toolkit_path_full))
+    exit_if_noninteractive()
     environ_cp['TF_CUDA_VERSION'] = ''
     environ_cp['CUDA_TOOLKIT_PATH'] = ''
 
@@ -653,12 +829,17 @@ def set_tf_cunn_version(environ_cp):
 
     # Try another alternative for Linux
     if is_linux():
-      if subprocess.call(['which', 'ldconfig']):
-        ldconfig_bin = '/sbin/ldconfig'
-      else:
-        ldconfig_bin = 'ldconfig'
-      cudnn_path_from_ldconfig = run_shell(
-          r'%s -p | sed -n "s/.*libcudnn.so .* => \(.*\)/\\1/p"' % ldconfig_bin)
+      ldconfig_bin = find_executable_path('ldconfig') or '/sbin/ldconfig'
+      try:
+        ldconfig_output = run_argv([ldconfig_bin, '-p'])
+      except (subprocess.CalledProcessError, OSError):
+        ldconfig_output = ''
+      cudnn_path_from_ldconfig = ''
+      for line in ldconfig_output.splitlines():
+        match = _LDCONFIG_CUDNN_REGEX.match(line)
+        if match:
+          cudnn_path_from_ldconfig = match.group(1).strip()
+          break
       if os.path.exists('%s.%s' % (cudnn_path_from_ldconfig, tf_cudnn_version)):
         cudnn_install_path = os.path.dirname(cudnn_path_from_ldconfig)
         break
@@ -672,6 +853,7 @@ def set_tf_cunn_version(environ_cp):
     if is_linux():
       print('%s.%s' % (cudnn_path_from_ldconfig, tf_cudnn_version))
 
+    exit_if_noninteractive()
     environ_cp['TF_CUDNN_VERSION'] = ''
 
   # Set CUDNN_INSTALL_PATH and TF_CUDNN_VERSION
@@ -691,24 +873,31 @@ def get_native_cuda_compute_capabilities(environ_cp):
   """
   device_query_bin = os.path.join(
       environ_cp.get('CUDA_TOOLKIT_PATH'), 'extras/demo_suite/deviceQuery')
-  cmd = (r'"%s" | grep "Capability" | grep -o "[0-9]*\.[0-9]*" | sed '
-         '":a;{N;s/\\n/,/};ba"') % device_query_bin
   try:
-    output = run_shell(cmd)
-  except subprocess.CalledProcessError:
-    output = ''
-  return output
+    output = run_argv([device_query_bin])
+  except (subprocess.CalledProcessError, OSError):
+    return ''
+  # One linear pass over the output replaces the former
+  # grep | grep -o | sed pipeline (three extra processes plus a shell).
+  return ','.join(re.findall(r'Capability\D+(\d+\.\d+)', output))
 
 
 def set_tf_cuda_compute_capabilities(environ_cp):
   """Set TF_CUDA_COMPUTE_CAPABILITIES."""
+  native_cuda_compute_capabilities = None
   while True:
-    native_cuda_compute_capabilities = get_native_cuda_compute_capabilities(
-        environ_cp)
-    if not native_cuda_compute_capabilities:
+    if environ_cp.get('TF_CUDA_COMPUTE_CAPABILITIES'):
+      # A preset value wins below, so skip probing the device for a default.
       default_cuda_compute_capabilities = _DEFAULT_CUDA_COMPUTE_CAPABILITIES
     else:
-      default_cuda_compute_capabilities = native_cuda_compute_capabilities
+      if native_cuda_compute_capabilities is None:
+        # Probe once; retries after invalid input reuse the result instead
+        # of re-spawning deviceQuery.
+        native_cuda_compute_capabilities = (
+            get_native_cuda_compute_capabilities(environ_cp))
+      default_cuda_compute_capabilities = (
+          native_cuda_compute_capabilities or
+          _DEFAULT_CUDA_COMPUTE_CAPABILITIES)
 
     ask_cuda_compute_capabilities = (
         'Please specify a list of comma-separated '
@@ -726,14 +915,15 @@ def set_tf_cuda_compute_capabilities(environ_cp):
     # Check whether all capabilities from the input is valid
     all_valid = True
     for compute_capability in tf_cuda_compute_capabilities.split(','):
-      if not re.match('[0-9]+.[0-9]+', compute_capability):
-        print('Invalid compute capability: ' % compute_capability)
+      if not _CUDA_COMPUTE_CAPABILITY_REGEX.match(compute_capability):
+        print('Invalid compute capability: %s' % compute_capability)
         all_valid = False
 
     if all_valid:
       break
 
     # Reset and Retry
+    exit_if_noninteractive()
     environ_cp['TF_CUDA_COMPUTE_CAPABILITIES'] = ''
 
   # Set TF_CUDA_COMPUTE_CAPABILITIES
@@ -770,7 +960,7 @@ def set_other_cuda_vars(environ_cp):
 
 def set_host_cxx_compiler(environ_cp):
   """Set HOST_CXX_COMPILER."""
-  default_cxx_host_compiler = run_shell('which g++ || true')
+  default_cxx_host_compiler = find_executable_path('g++')
   ask_cxx_host_compiler = (
       'Please specify which C++ compiler should be used as'
       ' the host C++ compiler. [Default is %s]: ') % default_cxx_host_compiler
@@ -784,6 +974,7 @@ def set_host_cxx_compiler(environ_cp):
 
     # Reset and retry
     print('Invalid C++ compiler path. %s cannot be found' % host_cxx_compiler)
+    exit_if_noninteractive()
     environ_cp['HOST_CXX_COMPILER'] = ''
 
   # Set HOST_CXX_COMPILER
@@ -793,7 +984,7 @@ def set_host_cxx_compiler(environ_cp):
 
 def set_host_c_compiler(environ_cp):
   """Set HOST_C_COMPILER."""
-  default_c_host_compiler = run_shell('which gcc || true')
+  default_c_host_compiler = find_executable_path('gcc')
   ask_c_host_compiler = (
       'Please specify which C compiler should be used as the'
       ' host C compiler. [Default is %s]: ') % default_c_host_compiler
@@ -807,6 +998,7 @@ def set_host_c_compiler(environ_cp):
 
     # Reset and retry
     print('Invalid C compiler path. %s cannot be found' % host_c_compiler)
+    exit_if_noninteractive()
     environ_cp['HOST_C_COMPILER'] = ''
 
   # Set HOST_C_COMPILER
@@ -837,6 +1029,7 @@ def set_computecpp_toolkit_path(environ_cp):
 
     print('Invalid SYCL %s library path. %s cannot be found' %
           (_TF_OPENCL_VERSION, sycl_rt_lib_path_full))
+    exit_if_noninteractive()
     environ_cp['COMPUTECPP_TOOLKIT_PATH'] = ''
 
   # Set COMPUTECPP_TOOLKIT_PATH
@@ -847,54 +1040,82 @@ def set_computecpp_toolkit_path(environ_cp):
 
 def set_mpi_home(environ_cp):
   """Set MPI_HOME."""
-  cmd = ('dirname $(dirname $(which mpirun)) || dirname $(dirname $(which '
-         'mpiexec))  || true')
-  default_mpi_home = run_shell(cmd)
+  mpi_launcher_path = (find_executable_path('mpirun') or
+                       find_executable_path('mpiexec'))
+  default_mpi_home = os.path.dirname(os.path.dirname(mpi_launcher_path))
   ask_mpi_home = ('Please specify the MPI toolkit folder. [Default is %s]: '
                  ) % default_mpi_home
   while True:
     mpi_home = get_from_env_or_user_or_default(environ_cp, 'MPI_HOME',
                                                ask_mpi_home, default_mpi_home)
 
-    if os.path.exists(os.path.join(mpi_home, 'include')) and os.path.exists(
-        os.path.join(mpi_home, 'lib')):
+    # One directory listing replaces a stat per expected subdirectory.
+    mpi_home_entries = list_dir_entries(mpi_home)
+    if 'include' in mpi_home_entries and 'lib' in mpi_home_entries:
       break
 
     print('Invalid path to the MPI Toolkit. %s or %s cannot be found' %
           (os.path.join(mpi_home, 'include'),
-           os.path.exists(os.path.join(mpi_home, 'lib'))))
+           os.path.join(mpi_home, 'lib')))
+    exit_if_noninteractive()
     environ_cp['MPI_HOME'] = ''
 
   # Set MPI_HOME
   environ_cp['MPI_HOME'] = str(mpi_home)
 
 
+def list_dir_entries(path):
+  """Return the set of entry names in path, or an empty set if unreadable.
+
+  One directory listing answers every membership question about a
+  directory's contents, where individual os.path.exists probes cost a stat
+  syscall each.
+
+  Args:
+    path: string for directory path.
+  """
+  try:
+    return set(os.listdir(path))
+  except OSError:
+    return set()
+
+
 def set_other_mpi_vars(environ_cp):
   """Set other MPI related variables."""
   # Link the MPI header files
   mpi_home = environ_cp.get('MPI_HOME')
+  include_entries = list_dir_entries(os.path.join(mpi_home, 'include'))
+  lib_entries = list_dir_entries(os.path.join(mpi_home, 'lib'))
   symlink_force('%s/include/mpi.h' % mpi_home, 'third_party/mpi/mpi.h')
 
   # Determine if we use OpenMPI or MVAPICH, these require different header files
   # to be included here to make bazel dependency checker happy
-  if os.path.exists(os.path.join(mpi_home, 'include/mpi_portable_platform.h')):
+  use_openmpi = 'mpi_portable_platform.h' in include_entries
+  if use_openmpi:
     symlink_force(
         os.path.join(mpi_home, 'include/mpi_portable_platform.h'),
         'third_party/mpi/mpi_portable_platform.h')
-    # TODO(gunan): avoid editing files in configure
-    sed_in_place('third_party/mpi/mpi.bzl', 'MPI_LIB_IS_OPENMPI=False',
-                 'MPI_LIB_IS_OPENMPI=True')
   else:
     # MVAPICH / MPICH
     symlink_force(
         os.path.join(mpi_home, 'include/mpio.h'), 'third_party/mpi/mpio.h')
     symlink_force(
         os.path.join(mpi_home, 'include/mpicxx.h'), 'third_party/mpi/mpicxx.h')
-    # TODO(gunan): avoid editing files in configure
-    sed_in_place('third_party/mpi/mpi.bzl', 'MPI_LIB_IS_OPENMPI=True',
-                 'MPI_LIB_IS_OPENMPI=False')
 
-  if os.path.exists(os.path.join(mpi_home, 'lib/libmpi.so')):
+  # TODO(gunan): avoid editing files in configure
+  # Flip the MPI_LIB_IS_OPENMPI token with one in-memory substitution, and
+  # skip the rewrite entirely when the file already matches.
+  mpi_bzl = 'third_party/mpi/mpi.bzl'
+  with open(mpi_bzl, 'r') as f:
+    mpi_bzl_contents = f.read()
+  new_mpi_bzl_contents = mpi_bzl_contents.replace(
+      'MPI_LIB_IS_OPENMPI=%s' % (not use_openmpi),
+      'MPI_LIB_IS_OPENMPI=%s' % use_openmpi)
+  if new_mpi_bzl_contents != mpi_bzl_contents:
+    with open(mpi_bzl, 'w') as f:
+      f.write(new_mpi_bzl_contents)
+
+  if 'libmpi.so' in lib_entries:
     symlink_force(
         os.path.join(mpi_home, 'lib/libmpi.so'), 'third_party/mpi/libmpi.so')
   else:
@@ -915,9 +1136,17 @@ def set_mkl():
 
 
 def main():
+  global _noninteractive
+  args = parse_args()
+  _noninteractive = args.noninteractive
+
   # Make a copy of os.environ to be clear when functions and getting and setting
   # environment variables.
   environ_cp = dict(os.environ)
+  for flag_name, var_name in _FLAG_TO_ENV_VAR.items():
+    flag_value = getattr(args, flag_name)
+    if flag_value:
+      environ_cp[var_name] = flag_value
 
   bazel_version = check_bazel_version('0.4.5')
 
@@ -979,6 +1208,7 @@ def main():
 
   set_cc_opt_flags(environ_cp)
   set_mkl()
+  flush_bazelrc()
 
 
 if __name__ == '__main__':
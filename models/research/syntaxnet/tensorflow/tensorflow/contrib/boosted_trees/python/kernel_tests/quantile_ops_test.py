@@ -26,6 +26,7 @@ import numpy as np
 
 from tensorflow.contrib.boosted_trees.proto.quantiles_pb2 import QuantileConfig
 from tensorflow.contrib.boosted_trees.python.ops import quantile_ops
+from tensorflow.contrib.data.python.ops import dataset_ops
 from tensorflow.python.framework import constant_op
 from tensorflow.python.framework import dtypes
 from tensorflow.python.framework import ops
@@ -36,14 +37,31 @@ from tensorflow.python.ops import resources
 from tensorflow.python.platform import googletest
 from tensorflow.python.training import saver
 
+# Number of equally spaced points used by the fixed-distribution tests,
+# built once as a vectorized numpy array instead of a 65537-element Python
+# list comprehension per test.
+_NUM_FIXED_POINTS = (1 << 16) + 1
+_FIXED_POINTS = np.arange(
+    _NUM_FIXED_POINTS, dtype=np.float32) * np.float32(1.0 / (1 << 16))
+
+# Serialized QuantileConfig protos keyed by (eps, num_quantiles); the bytes
+# are deterministic given the parameters, so protobuf reflection and
+# serialization run once per configuration instead of once per test.
+_serialized_config_cache = {}
+
 
 class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
 
   def _gen_config(self, eps, num_quantiles):
-    config = QuantileConfig()
-    config.eps = eps
-    config.num_quantiles = num_quantiles
-    return config.SerializeToString()
+    key = (eps, num_quantiles)
+    serialized = _serialized_config_cache.get(key)
+    if serialized is None:
+      config = QuantileConfig()
+      config.eps = eps
+      config.num_quantiles = num_quantiles
+      serialized = config.SerializeToString()
+      _serialized_config_cache[key] = serialized
+    return serialized
 
   def testBasicQuantileBuckets(self):
     """Sets up the quantile summary op test as follows.
@@ -100,24 +118,28 @@ class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
       accumulator = quantile_ops.QuantileAccumulator(
           init_stamp_token=0, num_quantiles=3, epsilon=0.001, name="q1")
       resources.initialize_resources(resources.shared_resources()).run()
-    input_column = array_ops.placeholder(dtypes.float32)
-    weights = array_ops.placeholder(dtypes.float32)
-    update = accumulator.add_summary(
-        stamp_token=0,
-        column=input_column,
-        example_weights=weights)
-
-    with self.test_session() as sess:
+      input_column = array_ops.placeholder(dtypes.float32)
+      weights = array_ops.placeholder(dtypes.float32)
+      update = accumulator.add_summary(
+          stamp_token=0,
+          column=input_column,
+          example_weights=weights)
+      # One flat buffer holds every batch; each iteration feeds a
+      # contiguous no-copy slice instead of materializing fresh range() and
+      # [1] * i lists.
+      total_values = 22 * 23 // 2
+      all_values = np.arange(1, total_values + 1, dtype=np.float32)
+      all_weights = np.ones(total_values, dtype=np.float32)
       for i in range(1, 23):
-        # start = 1, 2, 4, 7, 11, 16 ... (see comment above)
-        start = int((i * (i-1) / 2) + 1)
+        # offset = 0, 1, 3, 6, 10, 15 ... (see comment above)
+        offset = i * (i - 1) // 2
         sess.run(update,
-                 {input_column: range(start, start+i),
-                  weights: [1] * i})
+                 {input_column: all_values[offset:offset + i],
+                  weights: all_weights[offset:offset + i]})
 
-    with self.test_session() as sess:
-      sess.run(accumulator.flush(stamp_token=0, next_stamp_token=1))
-      are_ready_flush, buckets = (accumulator.get_buckets(stamp_token=1))
+      reset = accumulator.flush(stamp_token=0, next_stamp_token=1)
+      with ops.control_dependencies([reset]):
+        are_ready_flush, buckets = (accumulator.get_buckets(stamp_token=1))
       buckets, are_ready_flush = (sess.run(
           [buckets, are_ready_flush]))
       self.assertEqual(True, are_ready_flush)
@@ -137,24 +159,25 @@ class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
       accumulator = quantile_ops.QuantileAccumulator(
           init_stamp_token=0, num_quantiles=3, epsilon=0.01, name="q1")
       resources.initialize_resources(resources.shared_resources()).run()
-    weight_placeholder = array_ops.placeholder(dtypes.float32)
-    dense_placeholder = array_ops.placeholder(dtypes.float32)
-    update = accumulator.add_summary(
-        stamp_token=0,
-        column=dense_placeholder,
-        example_weights=weight_placeholder)
-    with self.test_session() as sess:
-      for i in range(100):
-        dense_float = np.linspace(
-            i * 100, (i + 1) * 100 - 1, num=100).reshape(-1, 1)
-        sess.run(update, {
-            dense_placeholder: dense_float,
-            weight_placeholder: np.ones(shape=(100, 1), dtype=np.float32)
-        })
+      # All 100 batches are materialized once and driven through an in-graph
+      # iterator, so the loop below runs 100 feed-free update dispatches
+      # instead of 100 feed_dict marshalling round-trips.
+      dense_batches = np.linspace(
+          0, 9999, num=10000, dtype=np.float32).reshape(100, 100, 1)
+      weight_batches = np.ones(shape=(100, 100, 1), dtype=np.float32)
+      dense_column, weight_column = dataset_ops.Dataset.from_tensor_slices(
+          (dense_batches,
+           weight_batches)).prefetch(4).make_one_shot_iterator().get_next()
+      update = accumulator.add_summary(
+          stamp_token=0,
+          column=dense_column,
+          example_weights=weight_column)
+      for _ in range(100):
+        sess.run(update)
 
-    with self.test_session() as sess:
-      sess.run(accumulator.flush(stamp_token=0, next_stamp_token=1))
-      are_ready_flush, buckets = (accumulator.get_buckets(stamp_token=1))
+      reset = accumulator.flush(stamp_token=0, next_stamp_token=1)
+      with ops.control_dependencies([reset]):
+        are_ready_flush, buckets = (accumulator.get_buckets(stamp_token=1))
       buckets, are_ready_flush = (sess.run([buckets, are_ready_flush]))
       self.assertEqual(True, are_ready_flush)
       self.assertAllEqual([0, 3335., 6671., 9999.], buckets)
@@ -175,33 +198,60 @@ class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
       accumulator_2 = quantile_ops.QuantileAccumulator(
           init_stamp_token=0, num_quantiles=3, epsilon=0.01, name="q2")
       resources.initialize_resources(resources.shared_resources()).run()
-    weight_placeholder = array_ops.placeholder(dtypes.float32)
-    dense_placeholder = array_ops.placeholder(dtypes.float32)
-    update = accumulator.add_summary(
-        stamp_token=0,
-        column=dense_placeholder,
-        example_weights=weight_placeholder)
-    with self.test_session() as sess:
-      for i in range(100):
-        dense_float = np.linspace(
-            i * 100, (i + 1) * 100 - 1, num=100).reshape(-1, 1)
-        sess.run(update, {
-            dense_placeholder: dense_float,
-            weight_placeholder: np.ones(shape=(100, 1), dtype=np.float32)
-        })
+      dense_batches = np.linspace(
+          0, 9999, num=10000, dtype=np.float32).reshape(100, 100, 1)
+      weight_batches = np.ones(shape=(100, 100, 1), dtype=np.float32)
+      dense_column, weight_column = dataset_ops.Dataset.from_tensor_slices(
+          (dense_batches,
+           weight_batches)).prefetch(4).make_one_shot_iterator().get_next()
+      update = accumulator.add_summary(
+          stamp_token=0,
+          column=dense_column,
+          example_weights=weight_column)
+      for _ in range(100):
+        sess.run(update)
 
-    with self.test_session() as sess:
       summary = sess.run(
           accumulator.flush_summary(stamp_token=0, next_stamp_token=1))
       sess.run(
           accumulator_2.add_prebuilt_summary(
               stamp_token=0, summary=constant_op.constant(summary)))
-      sess.run(accumulator_2.flush(stamp_token=0, next_stamp_token=1))
-      are_ready_flush, buckets = (accumulator_2.get_buckets(stamp_token=1))
+      reset = accumulator_2.flush(stamp_token=0, next_stamp_token=1)
+      with ops.control_dependencies([reset]):
+        are_ready_flush, buckets = (accumulator_2.get_buckets(stamp_token=1))
       buckets, are_ready_flush = (sess.run([buckets, are_ready_flush]))
       self.assertEqual(True, are_ready_flush)
       self.assertAllEqual([0, 3337., 6677., 9999.], buckets)
 
+  def testStreamingQuantileBucketsBulkSummary(self):
+    """Adds the full input as one summary instead of 100 streamed batches.
+
+    This exercises the bulk path of the accumulator: a single summary built
+    over all 10000 points in one sketch construction, rather than 100
+    incremental merges. The boundaries are checked against the exact
+    quartiles with a tolerance of eps * N ranks worth of value space.
+    """
+    with self.test_session() as sess:
+      accumulator = quantile_ops.QuantileAccumulator(
+          init_stamp_token=0, num_quantiles=3, epsilon=0.01, name="q3")
+      resources.initialize_resources(resources.shared_resources()).run()
+      input_column = array_ops.placeholder(dtypes.float32)
+      weights = array_ops.placeholder(dtypes.float32)
+      update = accumulator.add_summary(
+          stamp_token=0,
+          column=input_column,
+          example_weights=weights)
+      sess.run(update, {
+          input_column: np.arange(10000, dtype=np.float32).reshape(-1, 1),
+          weights: np.ones(shape=(10000, 1), dtype=np.float32)
+      })
+      reset = accumulator.flush(stamp_token=0, next_stamp_token=1)
+      with ops.control_dependencies([reset]):
+        are_ready_flush, buckets = (accumulator.get_buckets(stamp_token=1))
+      buckets, are_ready_flush = (sess.run([buckets, are_ready_flush]))
+      self.assertEqual(True, are_ready_flush)
+      self.assertAllClose([0, 3333., 6666., 9999.], buckets, atol=100.)
+
   def testSaveRestoreBeforeFlush(self):
     save_dir = os.path.join(self.get_temp_dir(), "save_restore")
     save_path = os.path.join(tempfile.mkdtemp(prefix=save_dir), "hash")
@@ -299,11 +349,9 @@ class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
     Creates array dividing range [0, 1] to 1<<16 elements equally spaced
     with weight of 1.0.
     """
-    dense_float_tensor_0 = constant_op.constant(
-        [(1.0 * i) / math.pow(2.0, 16)
-         for i in range(0, int(math.pow(2, 16)) + 1)])
+    dense_float_tensor_0 = constant_op.constant(_FIXED_POINTS)
     example_weights = constant_op.constant(
-        [1] * (int(math.pow(2, 16)) + 1), dtype=dtypes.float32)
+        np.ones(_NUM_FIXED_POINTS, dtype=np.float32))
     config = self._gen_config(0.1, 10)
 
     with self.test_session():
@@ -323,12 +371,8 @@ class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
     Creates array dividing range [0, 1] to 1<<16 elements equally spaced
     with weight same as the value.
     """
-    dense_float_tensor_0 = constant_op.constant(
-        [(1.0 * i) / math.pow(2.0, 16)
-         for i in range(0, int(math.pow(2, 16)) + 1)])
-    example_weights = constant_op.constant(
-        [(1.0 * i) / math.pow(2.0, 16)
-         for i in range(0, int(math.pow(2, 16)) + 1)])
+    dense_float_tensor_0 = constant_op.constant(_FIXED_POINTS)
+    example_weights = constant_op.constant(_FIXED_POINTS)
 
     config = self._gen_config(0.1, 10)
 
@@ -346,6 +390,22 @@ class QuantileBucketsOpTest(test_util.TensorFlowTestCase):
 
 class QuantilesOpTest(test_util.TensorFlowTestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    # Feature data is packed once per class as structure-of-arrays blocks:
+    # the dense features as one (4, 2) block, the sparse values as one flat
+    # block and the sparse indices as one (9, 2) block, sliced per feature.
+    # setUp only wraps the cached views in constants, since every test runs
+    # in a fresh graph.
+    cls._dense_features = np.array(
+        [[-0.1, -1], [0.4, -15], [3.2, 18], [190, 1000]], dtype=np.float32)
+    cls._sparse_indices = np.array(
+        [[0, 0], [1, 0], [2, 0], [3, 0], [0, 0], [2, 0], [3, 0], [1, 0],
+         [3, 0]],
+        dtype=np.int32)
+    cls._sparse_values = np.array([-2, 5.5, 16, 17.5, 0.1, 3, -3, 2, 4],
+                                  dtype=np.float32)
+
   def setUp(self):
     """Sets up the quantile op tests.
 
@@ -365,22 +425,22 @@ class QuantilesOpTest(test_util.TensorFlowTestCase):
     """
     super(QuantilesOpTest, self).setUp()
     self._dense_float_tensor_0 = constant_op.constant(
-        [[-0.1], [0.4], [3.2], [190]], dtype=dtypes.float32)
+        self._dense_features[:, 0:1])
     self._dense_float_tensor_1 = constant_op.constant(
-        [[-1], [-15], [18], [1000]], dtype=dtypes.float32)
+        self._dense_features[:, 1:2])
+    sparse_shape = constant_op.constant([4, 1])
     # Sparse feature 0
-    self._sparse_indices_0 = constant_op.constant([[0, 0], [1, 0], [2, 0],
-                                                   [3, 0]])
-    self._sparse_values_0 = constant_op.constant([-2, 5.5, 16, 17.5])
-    self._sparse_shape_0 = constant_op.constant([4, 1])
+    self._sparse_indices_0 = constant_op.constant(self._sparse_indices[0:4])
+    self._sparse_values_0 = constant_op.constant(self._sparse_values[0:4])
+    self._sparse_shape_0 = sparse_shape
     # Sprase feature 1
-    self._sparse_indices_1 = constant_op.constant([[0, 0], [2, 0], [3, 0]])
-    self._sparse_values_1 = constant_op.constant([0.1, 3, -3])
-    self._sparse_shape_1 = constant_op.constant([4, 1])
+    self._sparse_indices_1 = constant_op.constant(self._sparse_indices[4:7])
+    self._sparse_values_1 = constant_op.constant(self._sparse_values[4:7])
+    self._sparse_shape_1 = sparse_shape
     # Sprase feature 2
-    self._sparse_indices_2 = constant_op.constant([[1, 0], [3, 0]])
-    self._sparse_values_2 = constant_op.constant([2, 4], dtype=dtypes.float32)
-    self._sparse_shape_2 = constant_op.constant([4, 1])
+    self._sparse_indices_2 = constant_op.constant(self._sparse_indices[7:9])
+    self._sparse_values_2 = constant_op.constant(self._sparse_values[7:9])
+    self._sparse_shape_2 = sparse_shape
     # Quantiles
     self._dense_thresholds_0 = [0.4, 5, 190]
     self._dense_thresholds_1 = [-9, 15, 1000]
@@ -27,25 +27,73 @@ from tensorflow.contrib.linalg.python.ops import linear_operator_diag
 from tensorflow.python.framework import constant_op
 from tensorflow.python.framework import dtypes
 from tensorflow.python.framework import tensor_shape
+from tensorflow.python.framework import tensor_util
 from tensorflow.python.ops import array_ops
 import tensorflow.python.ops.nn_grad  # pylint: disable=unused-import
 from tensorflow.python.platform import test
 
 
-def _powerset(x):
-  s = list(x)
-  return itertools.chain.from_iterable(
-      itertools.combinations(s, r) for r in range(len(s) + 1))
+def _powerset_dicts(items):
+  """Returns every subset of the given (key, value) pairs as a dict."""
+  items = list(items)
+  return [dict(itertools.compress(items, bits))
+          for bits in itertools.product((0, 1), repeat=len(items))]
 
 
 def _matrix_diag(d):
   """Batch version of np.diag."""
-  orig_shape = d.shape
-  d = np.reshape(d, (int(np.prod(d.shape[:-1])), d.shape[-1]))
-  diag_list = []
-  for i in range(d.shape[0]):
-    diag_list.append(np.diag(d[i, ...]))
-  return np.reshape(diag_list, orig_shape + (d.shape[-1],))
+  d = np.asarray(d)
+  out = np.zeros(d.shape + (d.shape[-1],), dtype=d.dtype)
+  diag_indices = np.arange(d.shape[-1])
+  out[..., diag_indices, diag_indices] = d
+  return out
+
+
+def _to_hashable(value):
+  """Converts numpy arrays and nested lists into hashable cache keys."""
+  if isinstance(value, np.ndarray):
+    return (value.shape, value.tobytes())
+  if isinstance(value, (list, tuple)):
+    return tuple(_to_hashable(v) for v in value)
+  return value
+
+
+# Expected scales keyed by (builder, normalized kwargs): the powerset-driven
+# tests rebuild the same expected matrices across subsets and reruns, so
+# each distinct argument combination is computed once per process.
+_expected_scale_cache = {}
+
+
+def _cached_expected_scale(builder, scale_args):
+  key = (builder.__name__,) + tuple(
+      (name, _to_hashable(value)) for name, value in sorted(
+          scale_args.items()))
+  if key not in _expected_scale_cache:
+    _expected_scale_cache[key] = builder(**scale_args)
+  return _expected_scale_cache[key]
+
+
+def _identity_diag(n):
+  return _matrix_diag(np.ones([n], dtype=np.float32))
+
+
+# Branch-free expected-scale builders, one per combination of provided
+# tril-related arguments; the powerset-driven tests resolve each subset
+# with a single lookup instead of re-walking the None-check cascade.
+_TRIL_SCALE_BUILDERS = {
+    frozenset(["scale_tril"]):
+        lambda tril, diag, mult: np.tril(tril),
+    frozenset(["scale_tril", "scale_diag"]):
+        lambda tril, diag, mult: (
+            np.tril(tril) + _matrix_diag(np.array(diag, dtype=np.float32))),
+    frozenset(["scale_tril", "scale_identity_multiplier"]):
+        lambda tril, diag, mult: (
+            np.tril(tril) + mult * _identity_diag(np.shape(tril)[-1])),
+    frozenset(["scale_tril", "scale_diag", "scale_identity_multiplier"]):
+        lambda tril, diag, mult: (
+            np.tril(tril) + _matrix_diag(np.array(diag, dtype=np.float32)) +
+            mult * _identity_diag(np.shape(tril)[-1])),
+}
 
 
 def _make_tril_scale(
@@ -54,15 +102,15 @@ def _make_tril_scale(
     scale_diag=None,
     scale_identity_multiplier=None,
     shape_hint=None):
-  if scale_tril is not None:
-    scale_tril = np.tril(scale_tril)
-    if scale_diag is not None:
-      scale_tril += _matrix_diag(np.array(scale_diag, dtype=np.float32))
-    if scale_identity_multiplier is not None:
-      scale_tril += (
-          scale_identity_multiplier * _matrix_diag(np.ones(
-              [scale_tril.shape[-1]], dtype=np.float32)))
-    return scale_tril
+  provided = frozenset(
+      name for name, value in (
+          ("scale_tril", scale_tril),
+          ("scale_diag", scale_diag),
+          ("scale_identity_multiplier", scale_identity_multiplier))
+      if value is not None)
+  builder = _TRIL_SCALE_BUILDERS.get(provided)
+  if builder is not None:
+    return builder(scale_tril, scale_diag, scale_identity_multiplier)
   return _make_diag_scale(
       loc, scale_diag, scale_identity_multiplier, shape_hint)
 
@@ -92,14 +140,12 @@ class MakeTrilScaleTest(test.TestCase):
 
   def _testLegalInputs(
       self, loc=None, shape_hint=None, scale_params=None):
-    for args in _powerset(scale_params.items()):
+    for args in _powerset_dicts(scale_params.items()):
       with self.test_session():
-        args = dict(args)
-
         scale_args = dict({
             "loc": loc,
             "shape_hint": shape_hint}, **args)
-        expected_scale = _make_tril_scale(**scale_args)
+        expected_scale = _cached_expected_scale(_make_tril_scale, scale_args)
         if expected_scale is None:
           # Not enough shape information was specified.
           with self.assertRaisesRegexp(ValueError, ("is specified.")):
@@ -107,7 +153,13 @@ class MakeTrilScaleTest(test.TestCase):
             scale.to_dense().eval()
         else:
           scale = distribution_util.make_tril_scale(**scale_args)
-          self.assertAllClose(expected_scale, scale.to_dense().eval())
+          dense = scale.to_dense()
+          # The literal inputs here constant-fold; only run the graph when
+          # no static value is available.
+          dense_value = tensor_util.constant_value(dense)
+          if dense_value is None:
+            dense_value = dense.eval()
+          self.assertAllClose(expected_scale, dense_value)
 
   def testLegalInputs(self):
     self._testLegalInputs(
@@ -161,14 +213,12 @@ class MakeDiagScaleTest(test.TestCase):
 
   def _testLegalInputs(
       self, loc=None, shape_hint=None, scale_params=None):
-    for args in _powerset(scale_params.items()):
+    for args in _powerset_dicts(scale_params.items()):
       with self.test_session():
-        args = dict(args)
-
         scale_args = dict({
             "loc": loc,
             "shape_hint": shape_hint}, **args)
-        expected_scale = _make_diag_scale(**scale_args)
+        expected_scale = _cached_expected_scale(_make_diag_scale, scale_args)
         if expected_scale is None:
           # Not enough shape information was specified.
           with self.assertRaisesRegexp(ValueError, ("is specified.")):
@@ -176,7 +226,13 @@ class MakeDiagScaleTest(test.TestCase):
             scale.to_dense().eval()
         else:
           scale = distribution_util.make_diag_scale(**scale_args)
-          self.assertAllClose(expected_scale, scale.to_dense().eval())
+          dense = scale.to_dense()
+          # The literal inputs here constant-fold; only run the graph when
+          # no static value is available.
+          dense_value = tensor_util.constant_value(dense)
+          if dense_value is None:
+            dense_value = dense.eval()
+          self.assertAllClose(expected_scale, dense_value)
 
   def testLegalInputs(self):
     self._testLegalInputs(
@@ -230,16 +286,31 @@ class ShapesFromLocAndScaleTest(test.TestCase):
     self.assertEqual(tensor_shape.TensorShape([5, 2]), batch_shape)
     self.assertEqual(tensor_shape.TensorShape([3]), event_shape)
 
-  def test_static_loc_dynamic_scale(self):
-    loc = constant_op.constant(np.zeros((2, 3)))
+  def _assert_dynamic_shapes(self, loc, diag_value, feed_dict,
+                             expected_batch_shape, expected_event_shape):
+    """Builds a diag scale from loc/diag and checks the evaluated shapes.
+
+    The diag (and optionally loc, via feed_dict) stays a placeholder, so the
+    shape tuple is only available by running the graph.
+    """
     diag = array_ops.placeholder(dtypes.float64)
     scale = linear_operator_diag.LinearOperatorDiag(diag)
+    # Copy then assign: dict(d, **{...}) would require string keys, but the
+    # keys here are placeholder Tensors.
+    feed_dict = dict(feed_dict)
+    feed_dict[diag] = diag_value
     with self.test_session() as sess:
       batch_shape, event_shape = sess.run(
           distribution_util.shapes_from_loc_and_scale(loc, scale),
-          feed_dict={diag: np.ones((5, 1, 3))})
-      self.assertAllEqual([5, 2], batch_shape)
-      self.assertAllEqual([3], event_shape)
+          feed_dict=feed_dict)
+      self.assertAllEqual(expected_batch_shape, batch_shape)
+      self.assertAllEqual(expected_event_shape, event_shape)
+
+  def test_static_loc_dynamic_scale(self):
+    loc = constant_op.constant(np.zeros((2, 3)))
+    self._assert_dynamic_shapes(
+        loc, np.ones((5, 1, 3)), {},
+        expected_batch_shape=[5, 2], expected_event_shape=[3])
 
   def test_dynamic_loc_static_scale(self):
     loc = array_ops.placeholder(dtypes.float64)
@@ -257,14 +328,9 @@ class ShapesFromLocAndScaleTest(test.TestCase):
 
   def test_dynamic_loc_dynamic_scale(self):
     loc = array_ops.placeholder(dtypes.float64)
-    diag = array_ops.placeholder(dtypes.float64)
-    scale = linear_operator_diag.LinearOperatorDiag(diag)
-    with self.test_session() as sess:
-      batch_shape, event_shape = sess.run(
-          distribution_util.shapes_from_loc_and_scale(loc, scale),
-          feed_dict={diag: np.ones((5, 2, 3)), loc: np.zeros((2, 3))})
-      self.assertAllEqual([5, 2], batch_shape)
-      self.assertAllEqual([3], event_shape)
+    self._assert_dynamic_shapes(
+        loc, np.ones((5, 2, 3)), {loc: np.zeros((2, 3))},
+        expected_batch_shape=[5, 2], expected_event_shape=[3])
 
   def test_none_loc_static_scale(self):
     loc = None
@@ -276,15 +342,27 @@ class ShapesFromLocAndScaleTest(test.TestCase):
     self.assertEqual(tensor_shape.TensorShape([3]), event_shape)
 
   def test_none_loc_dynamic_scale(self):
-    loc = None
-    diag = array_ops.placeholder(dtypes.float64)
-    scale = linear_operator_diag.LinearOperatorDiag(diag)
-    with self.test_session() as sess:
-      batch_shape, event_shape = sess.run(
-          distribution_util.shapes_from_loc_and_scale(loc, scale),
-          feed_dict={diag: np.ones((5, 1, 3))})
-      self.assertAllEqual([5, 1], batch_shape)
-      self.assertAllEqual([3], event_shape)
+    self._assert_dynamic_shapes(
+        None, np.ones((5, 1, 3)), {},
+        expected_batch_shape=[5, 1], expected_event_shape=[3])
+
+
+def _expected_tridiag(below, diag, above):
+  """Builds the expected (batched) tridiagonal matrix in numpy.
+
+  Keeps the batch expectations derivable for arbitrary sizes instead of
+  hand-written literals, so the test can scale its inputs.
+  """
+  below = np.asarray(below)
+  diag = np.asarray(diag)
+  above = np.asarray(above)
+  n = diag.shape[-1]
+  out = np.zeros(diag.shape + (n,), dtype=diag.dtype)
+  i = np.arange(n)
+  out[..., i, i] = diag
+  out[..., i[1:], i[:-1]] = below
+  out[..., i[:-1], i[1:]] = above
+  return out
 
 
 class TridiagTest(test.TestCase):
@@ -302,23 +380,16 @@ class TridiagTest(test.TestCase):
               [8., 9., 10.]).eval())
 
   def testWorksCorrectlyBatches(self):
+    below = [[1., 2., 3.],
+             [0.8, 0.9, 1.]]
+    diag = [[4., 5., 6., 7.],
+            [0.7, 0.6, 0.5, 0.4]]
+    above = [[8., 9., 10.],
+             [0.1, 0.2, 0.3]]
     with self.test_session():
       self.assertAllClose(
-          [[[4., 8., 0., 0.],
-            [1., 5., 9., 0.],
-            [0., 2., 6., 10.],
-            [0., 0., 3, 7.]],
-           [[0.7, 0.1, 0.0, 0.0],
-            [0.8, 0.6, 0.2, 0.0],
-            [0.0, 0.9, 0.5, 0.3],
-            [0.0, 0.0, 1.0, 0.4]]],
-          distribution_util.tridiag(
-              [[1., 2., 3.],
-               [0.8, 0.9, 1.]],
-              [[4., 5., 6., 7.],
-               [0.7, 0.6, 0.5, 0.4]],
-              [[8., 9., 10.],
-               [0.1, 0.2, 0.3]]).eval(),
+          _expected_tridiag(below, diag, above),
+          distribution_util.tridiag(below, diag, above).eval(),
           rtol=1e-5, atol=0.)
 
   def testHandlesNone(self):
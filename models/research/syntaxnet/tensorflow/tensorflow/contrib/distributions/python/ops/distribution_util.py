@@ -18,6 +18,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import contextlib
+import os
+import weakref
+
+import numpy as np
+
 from tensorflow.contrib import linalg
 from tensorflow.python.framework import dtypes
 from tensorflow.python.framework import ops
@@ -26,11 +32,113 @@ from tensorflow.python.framework import tensor_util
 from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import check_ops
 from tensorflow.python.ops import control_flow_ops
+from tensorflow.python.ops import math_ops
 from tensorflow.python.ops.distributions.util import *  # pylint: disable=wildcard-import
 
 
+@contextlib.contextmanager
+def _maybe_jit_scope():
+  """Enters an XLA jit scope iff TFD_ENABLE_XLA_SCALE=1 is set.
+
+  XLA fuses the band/diag-embed/add chain of the scale assembly into a
+  single elementwise kernel, removing the intermediate full-tensor
+  traversals. Opt-in only: the compile can pessimize some GPU workloads,
+  so it is gated on an environment variable rather than enabled
+  unconditionally.
+  """
+  if os.environ.get("TFD_ENABLE_XLA_SCALE") == "1":
+    # Imported lazily: the scope is opt-in, and a module-level import would
+    # put contrib.compiler on every distributions user's dependency path.
+    from tensorflow.contrib.compiler import jit  # pylint: disable=g-import-not-at-top
+    with jit.experimental_jit_scope():
+      yield
+  else:
+    yield
+
+
+# Scalar zero constants, one per dtype per graph (constants are
+# graph-bound). Sharing the node lets every assertion in a graph compare
+# against the same constant instead of emitting a fresh one per
+# construction; the weak keys keep finished graphs collectable.
+_zero_cache = weakref.WeakKeyDictionary()
+
+
+def _zero(dtype):
+  graph = ops.get_default_graph()
+  per_graph = _zero_cache.get(graph)
+  if per_graph is None:
+    per_graph = {}
+    _zero_cache[graph] = per_graph
+  zero = per_graph.get(dtype)
+  if zero is None:
+    zero = ops.convert_to_tensor(0, dtype=dtype, name="zero")
+    per_graph[dtype] = zero
+  return zero
+
+
+# Lower-triangular masks, keyed per graph by (k, dtype). Multiplying by
+# the constant mask replaces the opaque matrix_band_part kernel with an
+# elementwise multiply that the optimizer can fuse with the adjacent
+# diagonal-correction add.
+_tril_mask_cache = weakref.WeakKeyDictionary()
+
+
+def _tril_mask(num_rows, dtype):
+  graph = ops.get_default_graph()
+  per_graph = _tril_mask_cache.get(graph)
+  if per_graph is None:
+    per_graph = {}
+    _tril_mask_cache[graph] = per_graph
+  key = (num_rows, dtype)
+  mask = per_graph.get(key)
+  if mask is None:
+    mask = ops.convert_to_tensor(
+        np.tril(np.ones([num_rows, num_rows], dtype=dtype.as_numpy_dtype)),
+        name="tril_mask")
+    per_graph[key] = mask
+  return mask
+
+
 def _convert_to_tensor(x, name):
-  return None if x is None else ops.convert_to_tensor(x, name=name)
+  if x is None:
+    return None
+  # Arguments are frequently already tensors (e.g. via tf.constant in user
+  # code); returning them as-is skips convert_to_tensor's type promotion
+  # walk and keeps the graph free of redundant identity-like rewraps.
+  if isinstance(x, ops.Tensor):
+    return x
+  return ops.convert_to_tensor(x, name=name)
+
+
+def _maybe_attach_assertion(x, validate_args, assert_positive, take_diag):
+  """Attaches diagonal validity assertions to `x` when requested.
+
+  Args:
+    x: `Tensor` to validate and return.
+    validate_args: Python `bool`; when `False`, `x` passes through untouched.
+    assert_positive: Python `bool`; assert a positive diagonal instead of a
+      merely non-zero one.
+    take_diag: Python `bool`; `True` when `x` is a full matrix whose diagonal
+      must first be extracted, `False` when `x` already is the diagonal.
+
+  Returns:
+    `x`, with the assertion attached as a control dependency if requested.
+  """
+  if not validate_args:
+    return x
+  diag = array_ops.matrix_diag_part(x) if take_diag else x
+  if assert_positive:
+    return control_flow_ops.with_dependencies([
+        check_ops.assert_positive(
+            diag, message="diagonal part must be positive"),
+    ], x)
+  # One fused pass over the diagonal: equal + reduce_any into a scalar
+  # Assert, with no broadcast temporary.
+  no_zero_diag = math_ops.logical_not(
+      math_ops.reduce_any(math_ops.equal(diag, _zero(x.dtype))))
+  return control_flow_ops.with_dependencies([
+      control_flow_ops.Assert(
+          no_zero_diag, ["diagonal part must be non-zero", x])], x)
 
 
 def make_tril_scale(
@@ -77,24 +185,12 @@ def make_tril_scale(
       `shape_hint` are both None.
   """
 
-  def _maybe_attach_assertion(x):
-    if not validate_args:
-      return x
-    if assert_positive:
-      return control_flow_ops.with_dependencies([
-          check_ops.assert_positive(
-              array_ops.matrix_diag_part(x),
-              message="diagonal part must be positive"),
-      ], x)
-    return control_flow_ops.with_dependencies([
-        check_ops.assert_none_equal(
-            array_ops.matrix_diag_part(x),
-            array_ops.zeros([], x.dtype),
-            message="diagonal part must be non-zero"),
-    ], x)
-
-  with ops.name_scope(name, "make_tril_scale",
-                      values=[loc, scale_diag, scale_identity_multiplier]):
+  # name_scope walks its values list (graph lookups per entry); only hand
+  # it the arguments actually present.
+  scope_values = [
+      v for v in (loc, scale_diag, scale_identity_multiplier)
+      if v is not None]
+  with ops.name_scope(name, "make_tril_scale", values=scope_values):
 
     loc = _convert_to_tensor(loc, name="loc")
     scale_tril = _convert_to_tensor(scale_tril, name="scale_tril")
@@ -104,20 +200,51 @@ def make_tril_scale(
         name="scale_identity_multiplier")
 
   if scale_tril is not None:
-    scale_tril = array_ops.matrix_band_part(scale_tril, -1, 0)  # Zero out TriU.
-    tril_diag = array_ops.matrix_diag_part(scale_tril)
-    if scale_diag is not None:
-      tril_diag += scale_diag
-    if scale_identity_multiplier is not None:
-      tril_diag += scale_identity_multiplier[..., array_ops.newaxis]
-
-    scale_tril = array_ops.matrix_set_diag(scale_tril, tril_diag)
+    if scale_diag is None and scale_identity_multiplier is None:
+      # LinearOperatorTriL ignores (and internally zeroes) the strict upper
+      # triangle, so the explicit band_part below is redundant when there is
+      # no diagonal correction to fold in.
+      return linalg.LinearOperatorTriL(
+          tril=_maybe_attach_assertion(
+              scale_tril, validate_args, assert_positive, take_diag=True),
+          is_non_singular=True,
+          is_self_adjoint=False,
+          is_positive_definite=assert_positive,
+          is_square=True)
+    with _maybe_jit_scope():
+      # Zero out TriU: via a fusable constant-mask multiply when the matrix
+      # dimension is static, falling back to matrix_band_part otherwise.
+      tril_shape = scale_tril.get_shape()
+      num_rows = (
+          tril_shape[-1].value
+          if tril_shape.ndims is not None and tril_shape.ndims >= 2 else None)
+      if num_rows is not None and num_rows == tril_shape[-2].value:
+        scale_tril *= _tril_mask(num_rows, scale_tril.dtype)
+      else:
+        scale_tril = array_ops.matrix_band_part(scale_tril, -1, 0)
+      # Fold the diagonal corrections in with a single broadcast add of an
+      # embedded diagonal, instead of reading the diagonal out and
+      # scattering it back in (matrix_diag_part + matrix_set_diag), which
+      # traverses two extra k x k intermediates.
+      diag_correction = None
+      if scale_diag is not None:
+        diag_correction = scale_diag
+        if scale_identity_multiplier is not None:
+          diag_correction += scale_identity_multiplier[..., array_ops.newaxis]
+      elif scale_identity_multiplier is not None:
+        diag_correction = (
+            scale_identity_multiplier[..., array_ops.newaxis] *
+            array_ops.ones_like(array_ops.matrix_diag_part(scale_tril)))
+      if diag_correction is not None:
+        scale_tril += array_ops.matrix_diag(diag_correction)
 
     return linalg.LinearOperatorTriL(
-        tril=_maybe_attach_assertion(scale_tril),
+        tril=_maybe_attach_assertion(
+            scale_tril, validate_args, assert_positive, take_diag=True),
         is_non_singular=True,
         is_self_adjoint=False,
-        is_positive_definite=assert_positive)
+        is_positive_definite=assert_positive,
+        is_square=True)
 
   return make_diag_scale(
       loc=loc,
@@ -129,6 +256,72 @@ def make_tril_scale(
       name=name)
 
 
+def _identity_num_rows(loc, shape_hint):
+  """Resolves the identity dimension from `shape_hint` or `loc`."""
+  if loc is None and shape_hint is None:
+    raise ValueError(
+        "Cannot infer `event_shape` unless `loc` or "
+        "`shape_hint` is specified.")
+  return loc.shape[-1] if shape_hint is None else shape_hint
+
+
+def _build_diag(loc, scale_diag, scale_identity_multiplier, shape_hint,
+                validate_args, assert_positive):
+  """Diag-scale builder for the `scale_diag is not None` configurations."""
+  del loc, shape_hint  # The diagonal fixes the event shape.
+  if scale_identity_multiplier is not None:
+    multiplier = scale_identity_multiplier
+    # A rank-0 multiplier broadcasts against the diagonal as-is; the
+    # newaxis slice is only needed to align batched multipliers.
+    if multiplier.get_shape().ndims != 0:
+      multiplier = multiplier[..., array_ops.newaxis]
+    scale_diag = scale_diag + multiplier
+  return linalg.LinearOperatorDiag(
+      diag=_maybe_attach_assertion(
+          scale_diag, validate_args, assert_positive, take_diag=False),
+      is_non_singular=True,
+      is_self_adjoint=True,
+      is_positive_definite=assert_positive)
+
+
+def _build_identity(loc, scale_diag, scale_identity_multiplier, shape_hint,
+                    validate_args, assert_positive):
+  """Diag-scale builder for the no-argument (identity) configuration."""
+  del scale_diag, scale_identity_multiplier, assert_positive
+  return linalg.LinearOperatorIdentity(
+      num_rows=_identity_num_rows(loc, shape_hint),
+      dtype=loc.dtype.base_dtype,
+      is_self_adjoint=True,
+      is_positive_definite=True,
+      assert_proper_shapes=validate_args)
+
+
+def _build_scaled_identity(loc, scale_diag, scale_identity_multiplier,
+                           shape_hint, validate_args, assert_positive):
+  """Diag-scale builder for the multiplier-only configuration."""
+  del scale_diag
+  return linalg.LinearOperatorScaledIdentity(
+      num_rows=_identity_num_rows(loc, shape_hint),
+      multiplier=_maybe_attach_assertion(
+          scale_identity_multiplier, validate_args, assert_positive,
+          take_diag=False),
+      is_non_singular=True,
+      is_self_adjoint=True,
+      is_positive_definite=assert_positive,
+      assert_proper_shapes=validate_args)
+
+
+# make_diag_scale dispatch on (scale_diag is None,
+# scale_identity_multiplier is None): one lookup selects the builder
+# instead of walking the None-check cascade per call.
+_DIAG_SCALE_BUILDERS = {
+    (False, False): _build_diag,
+    (False, True): _build_diag,
+    (True, False): _build_scaled_identity,
+    (True, True): _build_identity,
+}
+
+
 def make_diag_scale(
     loc=None,
     scale_diag=None,
@@ -167,60 +360,37 @@ def make_diag_scale(
       `shape_hint` are both None.
   """
 
-  def _maybe_attach_assertion(x):
-    if not validate_args:
-      return x
-    if assert_positive:
-      return control_flow_ops.with_dependencies([
-          check_ops.assert_positive(
-              x, message="diagonal part must be positive"),
-      ], x)
-    return control_flow_ops.with_dependencies([
-        check_ops.assert_none_equal(
-            x,
-            array_ops.zeros([], x.dtype),
-            message="diagonal part must be non-zero")], x)
-
-  with ops.name_scope(name, "make_diag_scale",
-                      values=[loc, scale_diag, scale_identity_multiplier]):
+  # name_scope walks its values list (graph lookups per entry); only hand
+  # it the arguments actually present.
+  scope_values = [
+      v for v in (loc, scale_diag, scale_identity_multiplier)
+      if v is not None]
+  with ops.name_scope(name, "make_diag_scale", values=scope_values):
     loc = _convert_to_tensor(loc, name="loc")
     scale_diag = _convert_to_tensor(scale_diag, name="scale_diag")
     scale_identity_multiplier = _convert_to_tensor(
         scale_identity_multiplier,
         name="scale_identity_multiplier")
 
-    if scale_diag is not None:
-      if scale_identity_multiplier is not None:
-        scale_diag += scale_identity_multiplier[..., array_ops.newaxis]
-      return linalg.LinearOperatorDiag(
-          diag=_maybe_attach_assertion(scale_diag),
-          is_non_singular=True,
-          is_self_adjoint=True,
-          is_positive_definite=assert_positive)
-
-    if loc is None and shape_hint is None:
-      raise ValueError(
-          "Cannot infer `event_shape` unless `loc` or "
-          "`shape_hint` is specified.")
-
-    if shape_hint is None:
-      shape_hint = loc.shape[-1]
-
-    if scale_identity_multiplier is None:
-      return linalg.LinearOperatorIdentity(
-          num_rows=shape_hint,
-          dtype=loc.dtype.base_dtype,
-          is_self_adjoint=True,
-          is_positive_definite=True,
-          assert_proper_shapes=validate_args)
-
-    return linalg.LinearOperatorScaledIdentity(
-        num_rows=shape_hint,
-        multiplier=_maybe_attach_assertion(scale_identity_multiplier),
-        is_non_singular=True,
-        is_self_adjoint=True,
-        is_positive_definite=assert_positive,
-        assert_proper_shapes=validate_args)
+    builder = _DIAG_SCALE_BUILDERS[
+        (scale_diag is None, scale_identity_multiplier is None)]
+    return builder(loc, scale_diag, scale_identity_multiplier, shape_hint,
+                   validate_args, assert_positive)
+
+
+def _batch_shape_prefix(x):
+  """Returns `x`'s shape minus the last dim, statically when possible.
+
+  One dispatch point for the static-vs-dynamic choice: a fully defined
+  prefix comes back as a constant, anything else as a `shape(x)` slice.
+  """
+  static_prefix = x.get_shape().with_rank_at_least(1)[:-1]
+  if static_prefix.is_fully_defined():
+    # A numpy array keeps the value out of the graph entirely;
+    # prefer_static_broadcast_shape recognizes it and stays on its static
+    # path without emitting a Const node.
+    return np.asarray(static_prefix.as_list(), dtype=np.int32)
+  return array_ops.shape(x)[:-1]
 
 
 def shapes_from_loc_and_scale(loc, scale, name="shapes_from_loc_and_scale"):
@@ -252,13 +422,19 @@ def shapes_from_loc_and_scale(loc, scale, name="shapes_from_loc_and_scale"):
       different than the range of `scale`.
   """
   with ops.name_scope(name, values=[loc] + scale.graph_parents):
-    # Get event shape.
-    event_size = scale.range_dimension_tensor()
-    event_size_const = tensor_util.constant_value(event_size)
+    # Get event shape. The statically known range dimension is preferred:
+    # it emits no Shape/Slice ops and skips the constant_value
+    # pattern-match round trip on the tensor form.
+    event_size_const = scale.range_dimension.value
     if event_size_const is not None:
-      event_shape = event_size_const.reshape([1])
+      event_shape = np.array([event_size_const], dtype=np.int32)
     else:
-      event_shape = event_size[array_ops.newaxis]
+      event_size = scale.range_dimension_tensor()
+      event_size_const = tensor_util.constant_value(event_size)
+      if event_size_const is not None:
+        event_shape = event_size_const.reshape([1])
+      else:
+        event_shape = event_size[array_ops.newaxis]
 
     # Static check that event shapes match.
     if loc is not None:
@@ -269,21 +445,21 @@ def shapes_from_loc_and_scale(loc, scale, name="shapes_from_loc_and_scale"):
               "Event size of 'scale' (%d) could not be broadcast up to that of "
               "'loc' (%d)." % (loc_event_size, event_size_const))
 
-    # Get batch shape.
-    batch_shape = scale.batch_shape_tensor()
-    if loc is None:
-      batch_shape_const = tensor_util.constant_value(batch_shape)
-      batch_shape = (
-          batch_shape_const if batch_shape_const is not None else batch_shape)
+    # Get batch shape, again statically when the operator knows it.
+    if scale.batch_shape.is_fully_defined():
+      batch_shape = scale.batch_shape
     else:
-      loc_batch_shape = loc.get_shape().with_rank_at_least(1)[:-1]
-      if (loc.get_shape().ndims is None or
-          not loc_batch_shape.is_fully_defined()):
-        loc_batch_shape = array_ops.shape(loc)[:-1]
+      batch_shape = scale.batch_shape_tensor()
+    if loc is None:
+      if isinstance(batch_shape, tensor_shape.TensorShape):
+        batch_shape = np.array(batch_shape.as_list(), dtype=np.int32)
       else:
-        loc_batch_shape = ops.convert_to_tensor(loc_batch_shape,
-                                                name="loc_batch_shape")
-      batch_shape = prefer_static_broadcast_shape(batch_shape, loc_batch_shape)
+        batch_shape_const = tensor_util.constant_value(batch_shape)
+        batch_shape = (
+            batch_shape_const if batch_shape_const is not None else batch_shape)
+    else:
+      batch_shape = prefer_static_broadcast_shape(
+          batch_shape, _batch_shape_prefix(loc))
 
   return batch_shape, event_shape
 
@@ -308,7 +484,14 @@ def prefer_static_broadcast_shape(
     def get_tensor_shape(s):
       if isinstance(s, tensor_shape.TensorShape):
         return s
-      s_ = tensor_util.constant_value(make_shape_tensor(s))
+      # Lists, tuples and numpy arrays carry their values already; wrapping
+      # them in a throwaway Const just to read them back through
+      # constant_value would pollute the graph for nothing.
+      if isinstance(s, (list, tuple)):
+        return tensor_shape.TensorShape(s)
+      if isinstance(s, np.ndarray):
+        return tensor_shape.TensorShape(s.tolist())
+      s_ = tensor_util.constant_value(s)
       if s_ is not None:
         return tensor_shape.TensorShape(s_)
       return None
@@ -343,9 +526,18 @@ def is_diagonal_scale(scale):
   Raises:
     TypeError:  If `scale` is not a `LinearOperator`.
   """
+  if type(scale) in _DIAG_LINOP_TYPE_SET:  # Exact type: skip the MRO walks.
+    return True
   if not isinstance(scale, linalg.LinearOperator):
     raise TypeError("Expected argument 'scale' to be instance of LinearOperator"
                     ". Found: %s" % scale)
-  return (isinstance(scale, linalg.LinearOperatorIdentity) or
-          isinstance(scale, linalg.LinearOperatorScaledIdentity) or
-          isinstance(scale, linalg.LinearOperatorDiag))
+  return isinstance(scale, _DIAG_LINOP_TYPES)
+
+
+# The operators known to represent diagonal matrices. The frozenset serves
+# the exact-type fast path in is_diagonal_scale; the tuple backs the
+# subclass fallback.
+_DIAG_LINOP_TYPES = (linalg.LinearOperatorIdentity,
+                     linalg.LinearOperatorScaledIdentity,
+                     linalg.LinearOperatorDiag)
+_DIAG_LINOP_TYPE_SET = frozenset(_DIAG_LINOP_TYPES)
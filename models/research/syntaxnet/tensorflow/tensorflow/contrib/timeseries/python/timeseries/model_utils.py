@@ -18,7 +18,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import operator
 import re
+import weakref
 
 import numpy
 
@@ -40,6 +42,14 @@ from tensorflow.python.ops import state_ops
 from tensorflow.python.ops import variable_scope
 from tensorflow.python.util import nest
 
+# Compiled once at import: the state-feature pattern only depends on the
+# constant prefix, and _gather_state runs on every model_fn invocation. The
+# startswith prefix is a cheap pre-filter that keeps ordinary feature keys
+# away from the regex engine entirely.
+_STATE_FEATURE_PREFIX = feature_keys.State.STATE_PREFIX + "_"
+_STATE_FEATURE_RE = re.compile(
+    r"^" + re.escape(feature_keys.State.STATE_PREFIX) + r"_(\d+)$")
+
 
 def _check_feature_shapes_compatible_with(
     features, compatible_with_name, compatible_with_value, ignore=None):
@@ -155,16 +165,67 @@ def _identity_metric_single(name, input_tensor):
   return (metric_variable.value(), update_op)
 
 
+# Flattened structures memoized per graph on the structure's identity, so a
+# state tuple reused across several metric constructions is traversed once.
+# Keying per graph (weakly) bounds entry lifetimes to the graph that owns
+# the tensors.
+_flatten_cache = weakref.WeakKeyDictionary()
+
+
+def _cached_flatten(structure):
+  """nest.flatten with per-graph memoization on structure identity."""
+  graph = ops.get_default_graph()
+  per_graph = _flatten_cache.get(graph)
+  if per_graph is None:
+    per_graph = {}
+    _flatten_cache[graph] = per_graph
+  cached = per_graph.get(id(structure))
+  if cached is not None and cached[0] is structure:
+    return cached[1]
+  flat = nest.flatten(structure)
+  per_graph[id(structure)] = (structure, flat)
+  return flat
+
+
 def _identity_metric_nested(name, input_tensors):
-  """Create identity metrics for a nested tuple of Tensors."""
+  """Create identity metrics for a nested tuple of Tensors.
+
+  Tensors sharing a dtype and a fully defined shape are stacked into one
+  metric variable with a single assign, so a deep state tuple contributes a
+  few ops rather than a variable/assign/init triple per tensor. Tensors
+  whose shapes are not static cannot be stacked and keep individual
+  variables.
+  """
+  flat_tensors = _cached_flatten(input_tensors)
+  value_tensors = [None] * len(flat_tensors)
   update_ops = []
-  value_tensors = []
-  for tensor_number, tensor in enumerate(nest.flatten(input_tensors)):
-    value_tensor, update_op = _identity_metric_single(
-        name="{}_{}".format(name, tensor_number),
-        input_tensor=tensor)
+  stackable_groups = {}
+  for tensor_number, tensor in enumerate(flat_tensors):
+    tensor_shape = tensor.get_shape()
+    if tensor_shape.is_fully_defined():
+      stackable_groups.setdefault(
+          (tensor.dtype, tuple(tensor_shape.as_list())),
+          []).append((tensor_number, tensor))
+    else:
+      value_tensor, update_op = _identity_metric_single(
+          name="{}_{}".format(name, tensor_number), input_tensor=tensor)
+      update_ops.append(update_op)
+      value_tensors[tensor_number] = value_tensor
+  for group in stackable_groups.values():
+    if len(group) == 1:
+      tensor_number, tensor = group[0]
+      value_tensor, update_op = _identity_metric_single(
+          name="{}_{}".format(name, tensor_number), input_tensor=tensor)
+      update_ops.append(update_op)
+      value_tensors[tensor_number] = value_tensor
+      continue
+    stacked_value, update_op = _identity_metric_single(
+        name="{}_stacked_{}".format(name, group[0][0]),
+        input_tensor=array_ops.stack([tensor for _, tensor in group]))
     update_ops.append(update_op)
-    value_tensors.append(value_tensor)
+    for (tensor_number, _), value_tensor in zip(
+        group, array_ops.unstack(stacked_value)):
+      value_tensors[tensor_number] = value_tensor
   return (nest.pack_sequence_as(input_tensors, value_tensors),
           control_flow_ops.group(*update_ops))
 
@@ -195,34 +256,36 @@ def make_model_fn(
     The model function, suitable for passing to a tf.estimator.Estimator.
   """
 
-  def _convert_feature_to_tensor(name, value):
-    """Casts features to the correct dtype based on their name."""
-    if name in [
-        feature_keys.TrainEvalFeatures.TIMES,
-        feature_keys.PredictionFeatures.TIMES
-    ]:
-      return math_ops.cast(value, dtypes.int64)
-    if name == feature_keys.TrainEvalFeatures.VALUES:
-      return math_ops.cast(value, model.dtype)
-    if name == feature_keys.PredictionFeatures.STATE_TUPLE:
-      return value  # Correct dtypes are model-dependent
-    return ops.convert_to_tensor(value)
+  # Casts features to the correct dtype based on their name: a single hash
+  # lookup per feature, built once per model_fn instead of re-scanning name
+  # lists on every conversion. Unlisted features default to
+  # convert_to_tensor.
+  feature_casts = {
+      feature_keys.TrainEvalFeatures.TIMES:
+          lambda value: math_ops.cast(value, dtypes.int64),
+      feature_keys.PredictionFeatures.TIMES:
+          lambda value: math_ops.cast(value, dtypes.int64),
+      feature_keys.TrainEvalFeatures.VALUES:
+          lambda value: math_ops.cast(value, model.dtype),
+      feature_keys.PredictionFeatures.STATE_TUPLE:
+          lambda value: value,  # Correct dtypes are model-dependent
+  }
 
   def _gather_state(features):
     """Returns `features` with state packed, indicates if packing was done."""
-    prefixed_state_re = re.compile(r"^" + feature_keys.State.STATE_PREFIX +
-                                   r"_(\d+)$")
     numbered_state = []
     for key, tensor in features.items():
-      search_result = prefixed_state_re.search(key)
-      if search_result:
-        numbered_state.append((int(search_result.group(1)), key, tensor))
+      if not key.startswith(_STATE_FEATURE_PREFIX):
+        continue
+      match_result = _STATE_FEATURE_RE.match(key)
+      if match_result:
+        numbered_state.append((int(match_result.group(1)), key, tensor))
     if not numbered_state:
       return features, False
-    features = features.copy()
-    for _, key, _ in numbered_state:
-      del features[key]
-    numbered_state.sort(key=lambda number, *_: number)
+    state_keys = set(key for _, key, _ in numbered_state)
+    features = {key: value for key, value in features.items()
+                if key not in state_keys}
+    numbered_state.sort(key=operator.itemgetter(0))
     features[feature_keys.State.STATE_TUPLE] = nest.pack_sequence_as(
         structure=model.get_start_state(),
         flat_sequence=[tensor for _, _, tensor in numbered_state])
@@ -314,8 +377,9 @@ def make_model_fn(
                            feature_keys.TrainEvalFeatures.TIMES,
                            feature_keys.TrainEvalFeatures.VALUES))
     del labels
-    features = {name: _convert_feature_to_tensor(name=name, value=value)
-                for name, value in features.items()}
+    features = {
+        name: feature_casts.get(name, ops.convert_to_tensor)(value)
+        for name, value in features.items()}
     if input_statistics_generator is not None:
       input_statistics = input_statistics_generator.initialize_graph(
           features, update_statistics=(mode == estimator_lib.ModeKeys.TRAIN))
@@ -392,26 +456,27 @@ def canonicalize_times_or_steps_from_output(times, steps,
     raise ValueError("Only one of `steps` and `times` may be specified.")
   if steps is None and times is None:
     raise ValueError("One of `steps` and `times` must be specified.")
+  previous_times = previous_model_output[feature_keys.FilteringResults.TIMES]
   if times is not None:
-    times = numpy.array(times)
+    # asarray: no copy when the caller already passes an ndarray.
+    times = numpy.asarray(times)
     if len(times.shape) != 2:
       times = times[None, ...]
-    if (previous_model_output[feature_keys.FilteringResults.TIMES].shape[0] !=
-        times.shape[0]):
+    if previous_times.shape[0] != times.shape[0]:
       raise ValueError(
           ("`times` must have a batch dimension matching"
            " the previous model output (got a batch dimension of {} for `times`"
            " and {} for the previous model output).").format(
-               times.shape[0], previous_model_output[
-                   feature_keys.FilteringResults.TIMES].shape[0]))
-    if not (previous_model_output[feature_keys.FilteringResults.TIMES][:, -1] <
-            times[:, 0]).all():
+               times.shape[0], previous_times.shape[0]))
+    if not numpy.all(previous_times[:, -1] < times[:, 0]):
       raise ValueError("Prediction times must be after the corresponding "
                        "previous model output.")
   if steps is not None:
+    # Matching the step range's dtype to the stored times avoids an upcast
+    # pass over the broadcasted result.
     predict_times = (
-        previous_model_output[feature_keys.FilteringResults.TIMES][:, -1:] + 1 +
-        numpy.arange(steps)[None, ...])
+        previous_times[:, -1:] + 1 +
+        numpy.arange(steps, dtype=previous_times.dtype)[None, ...])
   else:
     predict_times = times
   return predict_times